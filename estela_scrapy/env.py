@@ -1,5 +1,42 @@
+import functools
 import json
 import os
+from collections import namedtuple
+
+JobContext = namedtuple(
+    "JobContext",
+    [
+        "spider_job",
+        "jid",
+        "sid",
+        "pid",
+        "host",
+        "auth_token",
+        "collection",
+        "unique",
+        "job_url",
+    ],
+)
+
+
+@functools.lru_cache(maxsize=1)
+def job_context():
+    # The job identity is constant for the process lifetime: parse the env
+    # vars once and share the result between extensions and middlewares.
+    spider_job = os.getenv("ESTELA_SPIDER_JOB")
+    jid, sid, pid = spider_job.split(".")
+    host = os.getenv("ESTELA_API_HOST")
+    return JobContext(
+        spider_job=spider_job,
+        jid=jid,
+        sid=sid,
+        pid=pid,
+        host=host,
+        auth_token=os.getenv("ESTELA_AUTH_TOKEN"),
+        collection=os.getenv("ESTELA_COLLECTION"),
+        unique=os.getenv("ESTELA_UNIQUE_COLLECTION"),
+        job_url="{}/api/projects/{}/spiders/{}/jobs/{}".format(host, pid, sid, jid),
+    )
 
 
 def decode_job():
@@ -1,53 +1,158 @@
-import json
+import logging
 import os
-from datetime import datetime
+import sys
+import time
+from datetime import date, datetime, timedelta
 
+import orjson
 import redis
 from scrapy import signals
 from scrapy.exceptions import NotConfigured
 from scrapy.exporters import PythonItemExporter
-from twisted.internet import task
+from twisted.internet import task, threads
 
-from estela_scrapy.utils import json_serializer, producer
-
-from .utils import json_serializer, update_job
+from estela_scrapy.env import job_context
+from estela_scrapy.utils import json_serializer, producer, update_job
 
 RUNNING_STATUS = "RUNNING"
 COMPLETED_STATUS = "COMPLETED"
 
+_DATABASE_SIZE_JSON_KEY = sys.intern("database_size_json")
+
+
+def _to_primitive(value):
+    # Pre-walk values into JSON primitives so the encoder never has to fall
+    # back to a per-value Python callback for datetimes, timedeltas or
+    # containers in the stats dict.
+    if isinstance(value, (str, int, float, bool, type(None))):
+        return value
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, timedelta):
+        return value.total_seconds()
+    if isinstance(value, dict):
+        return {key: _to_primitive(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return [_to_primitive(item) for item in value]
+    return json_serializer(value)
+
 
 class BaseExtension:
     def __init__(self, stats, *args, **kwargs):
         self.stats = stats
-        self.auth_token = os.getenv("ESTELA_AUTH_TOKEN")
-        job = os.getenv("ESTELA_SPIDER_JOB")
-        host = os.getenv("ESTELA_API_HOST")
-        self.job_jid, spider_sid, project_pid = job.split(".")
-        self.job_url = "{}/api/projects/{}/spiders/{}/jobs/{}".format(
-            host, project_pid, spider_sid, self.job_jid
-        )
+        ctx = job_context()
+        self.auth_token = ctx.auth_token
+        self.spider_job = ctx.spider_job
+        self.job_jid = ctx.jid
+        self.job_url = ctx.job_url
 
 
 class ItemStorageExtension(BaseExtension):
-    def __init__(self, stats):
+    # Once this many sends are waiting on the kafka client, block on a flush
+    # so a fast spider cannot grow the producer buffer without bound.
+    MAX_INFLIGHT_ITEMS = 10000
+
+    def __init__(self, stats, size_sample_every=0):
         super().__init__(stats)
-        exporter_kwargs = {"binary": False}
-        self.exporter = PythonItemExporter(**exporter_kwargs)
+        try:
+            self.exporter = PythonItemExporter(binary=False)
+        except TypeError:
+            # the binary option was removed in recent Scrapy versions
+            self.exporter = PythonItemExporter()
+        self._serializer_cache = {}
+        self.collection = job_context().collection
+        self.unique = job_context().unique
+        # Measuring the JSON-encoded size of every item is too expensive for
+        # the item pipeline, so the stat is sampled: one in every
+        # size_sample_every items is measured and its contribution scaled up.
+        # Disabled (0) by default.
+        self.size_sample_every = size_sample_every
+        self._items_since_sample = 0
+        self._inflight = 0
+        # Direct reference to the collector's underlying dict: inc_value goes
+        # through default handling per call, which adds up at item rates.
+        # Falls back to the public API when _stats is not exposed.
+        self._stats_dict = getattr(stats, "_stats", None)
 
     @classmethod
     def from_crawler(cls, crawler):
-        ext = cls(crawler.stats)
+        ext = cls(
+            crawler.stats,
+            size_sample_every=crawler.settings.getint("ESTELA_SIZE_SAMPLE_EVERY", 0),
+        )
         crawler.signals.connect(ext.item_scraped, signals.item_scraped)
         return ext
 
+    def _export_item(self, item):
+        # Bypass the exporter's per-field dispatch on the hot path: plain
+        # dicts and scrapy Items are walked directly, with the serializer
+        # table built once per Item class from the field metadata.
+        if isinstance(item, dict):
+            return {name: self._export_value(value) for name, value in item.items()}
+        fields = getattr(item, "fields", None)
+        if fields is None:
+            return self.exporter.export_item(item)
+        serializers = self._serializer_cache.get(type(item))
+        if serializers is None:
+            serializers = {
+                name: field.get("serializer") for name, field in fields.items()
+            }
+            self._serializer_cache[type(item)] = serializers
+        exported = {}
+        for name in item.keys():
+            serializer = serializers.get(name)
+            value = item[name]
+            exported[name] = (
+                serializer(value) if serializer else self._export_value(value)
+            )
+        return exported
+
+    def _export_value(self, value):
+        # Nested Items and containers are exported recursively, mirroring
+        # PythonItemExporter._serialize_value.
+        if isinstance(value, dict) or getattr(value, "fields", None) is not None:
+            return self._export_item(value)
+        if isinstance(value, (list, tuple, set)):
+            return [self._export_value(item) for item in value]
+        return value
+
     def item_scraped(self, item, spider):
-        item = self.exporter.export_item(item)
+        item = self._export_item(item)
         data = {
-            "jid": os.getenv("ESTELA_COLLECTION"),
-            "payload": dict(item),
-            "unique": os.getenv("ESTELA_UNIQUE_COLLECTION"),
+            "jid": self.collection,
+            "payload": item,
+            "unique": self.unique,
         }
-        producer.send("job_items", data)
+        if self.size_sample_every:
+            self._items_since_sample += 1
+            if self._items_since_sample >= self.size_sample_every:
+                self._items_since_sample = 0
+                item_size = len(
+                    orjson.dumps(
+                        item, default=json_serializer, option=orjson.OPT_NON_STR_KEYS
+                    )
+                )
+                delta = item_size * self.size_sample_every
+                if self._stats_dict is not None:
+                    self._stats_dict[_DATABASE_SIZE_JSON_KEY] = (
+                        self._stats_dict.get(_DATABASE_SIZE_JSON_KEY, 0) + delta
+                    )
+                else:
+                    self.stats.inc_value(_DATABASE_SIZE_JSON_KEY, delta)
+        future = producer.send("job_items", data)
+        if future is not None:
+            self._inflight += 1
+            future.add_both(self._send_completed)
+            if self._inflight >= self.MAX_INFLIGHT_ITEMS:
+                producer.flush()
+                # The decrements run on kafka's IO thread and race the
+                # increments above, so the counter drifts; every future is
+                # resolved once flush returns, making this the safe point to
+                # resynchronize.
+                self._inflight = 0
+
+    def _send_completed(self, _):
+        self._inflight -= 1
 
 
 class RedisStatsCollector(BaseExtension):
@@ -61,6 +166,9 @@ class RedisStatsCollector(BaseExtension):
 
         self.stats_key = os.getenv("REDIS_STATS_KEY")
         self.interval = float(os.getenv("REDIS_STATS_INTERVAL"))
+        self.stats_expire = max(int(self.interval * 10), 60)
+        self._last_stats = {}
+        self._opened_update = None
 
     @classmethod
     def from_crawler(cls, crawler):
@@ -71,8 +179,17 @@ class RedisStatsCollector(BaseExtension):
 
         return ext
 
+    def _log_update_failure(self, failure):
+        logging.error(f"Failed to update the job status: {failure.getErrorMessage()}")
+
     def spider_opened(self, spider):
-        update_job(self.job_url, self.auth_token, status=RUNNING_STATUS)
+        # update_job issues a blocking HTTP request to the API; run it on the
+        # thread pool so the reactor keeps serving downloads in the meantime.
+        self._opened_update = threads.deferToThread(
+            update_job, self.job_url, self.auth_token, status=RUNNING_STATUS
+        )
+        self._opened_update.addErrback(self._log_update_failure)
+        self.start_time = time.monotonic()
         self.task = task.LoopingCall(self.store_stats, spider)
         self.task.start(self.interval)
 
@@ -86,31 +203,66 @@ class RedisStatsCollector(BaseExtension):
             pass
 
         stats = self.stats.get_stats()
-        update_job(
-            self.job_url,
-            self.auth_token,
-            status=COMPLETED_STATUS,
-            lifespan=int(stats.get("elapsed_time_seconds", 0)),
-            total_bytes=stats.get("downloader/response_bytes", 0),
-            item_count=stats.get("item_scraped_count", 0),
-            request_count=stats.get("downloader/request_count", 0),
-            proxy_usage_data={
-                "proxy_name": stats.get("downloader/proxy_name", ""),
-                "bytes": stats.get("downloader/proxies/response_bytes", 0),
-            },
-        )
 
-        parsed_stats = json.dumps(stats, default=json_serializer)
+        def send_completed_update(_):
+            return threads.deferToThread(
+                update_job,
+                self.job_url,
+                self.auth_token,
+                status=COMPLETED_STATUS,
+                lifespan=int(stats.get("elapsed_time_seconds", 0)),
+                total_bytes=stats.get("downloader/response_bytes", 0),
+                item_count=stats.get("item_scraped_count", 0),
+                request_count=stats.get("downloader/request_count", 0),
+                proxy_usage_data={
+                    "proxy_name": stats.get("downloader/proxy_name", ""),
+                    "bytes": stats.get("downloader/proxies/response_bytes", 0),
+                },
+            )
+
+        # Chain the COMPLETED patch after the RUNNING one so the two updates
+        # cannot reach the API out of order on short jobs.
+        if self._opened_update is not None:
+            deferred = self._opened_update.addBoth(send_completed_update)
+        else:
+            deferred = send_completed_update(None)
+        deferred.addErrback(self._log_update_failure)
+
         data = {
-            "jid": os.getenv("ESTELA_SPIDER_JOB"),
-            "payload": json.loads(parsed_stats),
+            "jid": self.spider_job,
+            "payload": {key: _to_primitive(value) for key, value in stats.items()},
         }
         producer.send("job_stats", data)
+        # Returning the deferred makes scrapy wait for the API update before
+        # finishing the shutdown sequence.
+        return deferred
 
     def store_stats(self, spider):
         stats = self.stats.get_stats()
-        elapsed_time = int((datetime.now() - stats.get("start_time")).total_seconds())
+        # monotonic is immune to wall-clock jumps and avoids the per-tick
+        # datetime/timedelta allocations of datetime.now() arithmetic.
+        elapsed_time = int(time.monotonic() - self.start_time)
         stats.update({"elapsed_time_seconds": elapsed_time})
 
-        parsed_stats = json.dumps(stats, default=json_serializer)
-        self.redis_conn.hmset(self.stats_key, json.loads(parsed_stats))
+        coerced = {}
+        for key, value in stats.items():
+            value = _to_primitive(value)
+            if isinstance(value, (dict, list)):
+                # redis hash values must stay flat
+                value = str(value)
+            coerced[key] = value
+        # Most stats counters are stable between ticks: only push the keys
+        # whose values changed since the last update.
+        delta = {
+            key: value
+            for key, value in coerced.items()
+            if self._last_stats.get(key) != value
+        }
+        self._last_stats = coerced
+        if not delta:
+            return
+
+        pipe = self.redis_conn.pipeline(transaction=False)
+        pipe.hset(self.stats_key, mapping=delta)
+        pipe.expire(self.stats_key, self.stats_expire)
+        pipe.execute()
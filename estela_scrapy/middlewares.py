@@ -1,45 +1,145 @@
 import logging
 import os
-import re
+import sys
+import weakref
+from collections import deque
+from functools import lru_cache
 
+from scrapy import signals
 from scrapy.exceptions import NotConfigured
 from scrapy.utils.python import to_bytes
-from scrapy.utils.request import request_fingerprint
+from twisted.internet import task
 from twisted.web import http
 
+try:
+    from scrapy.utils.request import request_fingerprint
+except ImportError:
+    # Removed in recent Scrapy versions in favor of crawler.request_fingerprinter
+    request_fingerprint = None
+
+from estela_scrapy.env import job_context
 from estela_scrapy.utils import parse_time, producer
 
 proxy_logger = logging.getLogger("proxy_mw")
 
+# Interned so the per-request stats updates hash an already-cached key
+_PROXIES_COUNT_KEY = sys.intern("downloader/proxies/count")
+_PROXIES_RESPONSE_BYTES_KEY = sys.intern("downloader/proxies/response_bytes")
+
+
+_COLON_SIZE = len(b": ")
+_CRLF_SIZE = len(b"\r\n")
+
 
 def get_header_size(headers):
     size = 0
+    lines = 0
     for key, value in headers.items():
+        key_size = _COLON_SIZE + len(key)
         if isinstance(value, (list, tuple)):
             for v in value:
-                size += len(b": ") + len(key) + len(v)
-    return size + len(b"\r\n") * (len(headers.keys()) - 1)
+                size += key_size + len(v)
+                lines += 1
+        else:
+            size += key_size + len(value)
+            lines += 1
+    return size + _CRLF_SIZE * max(lines - 1, 0)
 
 
+@lru_cache(maxsize=64)
 def get_status_size(response_status):
     return len(to_bytes(http.RESPONSES.get(response_status, b""))) + 15
 
 
 class StorageDownloaderMiddleware:
+    # Request metadata is buffered and handed to the producer in bursts so
+    # the kafka client can pack whole batches instead of one record per
+    # response; the buffer drains every FLUSH_INTERVAL seconds or as soon as
+    # FLUSH_MAX_ITEMS entries accumulate.
+    FLUSH_INTERVAL = 0.1
+    FLUSH_MAX_ITEMS = 512
+
+    # Copying a pre-sized template is cheaper than rebuilding a dict from
+    # literal keys on every response.
+    PAYLOAD_TEMPLATE = {
+        "url": None,
+        "status": 0,
+        "method": None,
+        "duration": 0,
+        "time": None,
+        "response_size": 0,
+        "fingerprint": None,
+    }
+
+    def __init__(self, fingerprinter=None):
+        self.jid = job_context().spider_job
+        self.fingerprinter = fingerprinter
+        self.buffer = deque()
+        self.flush_task = None
+        self._fingerprint_cache = weakref.WeakKeyDictionary()
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        mw = cls(getattr(crawler, "request_fingerprinter", None))
+        crawler.signals.connect(mw.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(mw.spider_closed, signal=signals.spider_closed)
+        return mw
+
+    def spider_opened(self, spider):
+        self.flush_task = task.LoopingCall(self.flush)
+        deferred = self.flush_task.start(self.FLUSH_INTERVAL, now=False)
+        deferred.addErrback(
+            lambda failure: logging.error(
+                f"job_requests flush loop failed: {failure.getErrorMessage()}"
+            )
+        )
+
+    def spider_closed(self, spider):
+        if self.flush_task is not None and self.flush_task.running:
+            self.flush_task.stop()
+        self.flush()
+
+    def flush(self):
+        pending, self.buffer = self.buffer, deque()
+        while pending:
+            data = pending.popleft()
+            try:
+                producer.send("job_requests", data)
+            except Exception:
+                # Re-queue the unsent payloads for the next flush window
+                # instead of dropping the whole batch.
+                pending.appendleft(data)
+                self.buffer.extendleft(reversed(pending))
+                logging.exception("Failed to send job_requests batch.")
+                break
+
+    def get_fingerprint(self, request):
+        # Caching in request.meta would leak across request.replace() (the
+        # redirect middleware copies meta into the redirected request), so
+        # any cache has to be keyed on the request object itself.
+        if self.fingerprinter is not None:
+            # scrapy's fingerprinter already memoizes per request object
+            return self.fingerprinter.fingerprint(request).hex()
+        fingerprint = self._fingerprint_cache.get(request)
+        if fingerprint is None:
+            fingerprint = request_fingerprint(request)
+            self._fingerprint_cache[request] = fingerprint
+        return fingerprint
+
     def process_response(self, request, response, spider):
-        data = {
-            "jid": os.getenv("ESTELA_SPIDER_JOB"),
-            "payload": {
-                "url": response.url,
-                "status": int(response.status),
-                "method": request.method,
-                "duration": int(request.meta.get("download_latency", 0) * 1000),
-                "time": parse_time(),
-                "response_size": len(response.body),
-                "fingerprint": request_fingerprint(request),
-            },
-        }
-        producer.send("job_requests", data)
+        payload = self.PAYLOAD_TEMPLATE.copy()
+        payload["url"] = response.url
+        # response.status is already an int, no cast needed
+        payload["status"] = response.status
+        payload["method"] = request.method
+        payload["duration"] = int(request.meta.get("download_latency", 0) * 1000)
+        payload["time"] = parse_time()
+        payload["response_size"] = len(response.body)
+        payload["fingerprint"] = self.get_fingerprint(request)
+        data = {"jid": self.jid, "payload": payload}
+        self.buffer.append(data)
+        if len(self.buffer) >= self.FLUSH_MAX_ITEMS:
+            self.flush()
         return response
 
 
@@ -58,19 +158,17 @@ class EstelaProxyMiddleware:
         self.url = os.getenv("ESTELA_PROXY_URL", "")
 
         proxy_scheme = "https" if self.url.startswith("https://") else "http"
-        host_wo_schema = re.sub(f"^{proxy_scheme}://", "", self.url)
+        host_wo_schema = self.url.removeprefix(f"{proxy_scheme}://")
         self.full_proxy_url = f"{proxy_scheme}://{self.username}:{self.password}@{host_wo_schema}:{self.port}"
 
         self.stats = stats
-        self.stats.set_value(
-            "downloader/proxy_name", os.getenv("ESTELA_PROXY_NAME"), spider=spider
-        )
+        self.stats.set_value("downloader/proxy_name", os.getenv("ESTELA_PROXY_NAME"))
 
     def process_request(self, request, spider):
         if not request.meta.get("proxies_disabled"):
             proxy_logger.debug("Using proxies with request %s", request.url)
             request.meta["proxy"] = self.full_proxy_url
-            self.stats.inc_value("downloader/proxies/count", spider=spider)
+            self.stats.inc_value(_PROXIES_COUNT_KEY)
 
     def process_response(self, request, response, spider):
         if not request.meta.get("proxies_disabled"):
@@ -80,7 +178,5 @@ class EstelaProxyMiddleware:
                 + get_status_size(response.status)
                 + 4
             )
-            self.stats.inc_value(
-                "downloader/proxies/response_bytes", reslen, spider=spider
-            )
+            self.stats.inc_value(_PROXIES_RESPONSE_BYTES_KEY, reslen)
         return response
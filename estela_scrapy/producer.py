@@ -0,0 +1,71 @@
+import logging
+import os
+
+import orjson
+from estela_queue_adapter import get_producer_interface
+from estela_queue_adapter.kafka.producer import KafkaProducerAdapter
+from estela_queue_adapter.utils import get_bootstrap_servers, json_serializer
+from kafka import KafkaProducer
+
+# Batching configuration for the job topics. Records accumulate for up to
+# linger_ms into batches of up to batch_size bytes before a produce request
+# is sent, trading a bounded amount of latency for a large throughput gain
+# on item-heavy jobs. acks=1 waits only for the partition leader, which is
+# enough for the job data streams.
+KAFKA_PRODUCER_CONFIG = {
+    "api_version": (0, 10),
+    "acks": 1,
+    "retries": 1,
+    "batch_size": 262144,
+    "linger_ms": 100,
+    "compression_type": "lz4",
+    "max_in_flight_requests_per_connection": 5,
+    # buffer_memory was removed in kafka-python 3.x; unsupported keys are
+    # filtered against the installed client's DEFAULT_CONFIG on connect.
+    "buffer_memory": 134217728,
+    "max_block_ms": 5000,
+}
+
+
+class BatchedKafkaProducer(KafkaProducerAdapter):
+    def get_connection(self):
+        if self.producer is not None:
+            return True
+        try:
+            bootstrap_servers = get_bootstrap_servers(self.listeners, self.port)
+            supported_config = {
+                key: value
+                for key, value in KAFKA_PRODUCER_CONFIG.items()
+                if key in KafkaProducer.DEFAULT_CONFIG
+            }
+            self.producer = KafkaProducer(
+                bootstrap_servers=bootstrap_servers,
+                value_serializer=lambda x: orjson.dumps(
+                    x, default=json_serializer, option=orjson.OPT_NON_STR_KEYS
+                ),
+                **supported_config,
+            )
+        except Exception as ex:
+            logging.error(str(ex))
+            return False
+        return True
+
+    def send(self, topic, data):
+        # Unlike the base adapter, return the future so callers can apply
+        # back-pressure on the number of in-flight records.
+        future = self.producer.send(topic, value=data)
+        future.add_errback(self.on_kafka_send_error)
+        return future
+
+
+def connect_kafka_producer():
+    return BatchedKafkaProducer(
+        listeners=os.getenv("QUEUE_PLATFORM_LISTENERS"),
+        port=os.getenv("QUEUE_PLATFORM_PORT"),
+    )
+
+
+def get_producer():
+    if os.getenv("QUEUE_PLATFORM") == "kafka":
+        return connect_kafka_producer()
+    return get_producer_interface()
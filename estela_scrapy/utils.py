@@ -2,7 +2,8 @@ import json
 from datetime import date, datetime, timedelta
 
 import requests
-from estela_queue_adapter import get_producer_interface
+
+from estela_scrapy.producer import get_producer
 
 
 def parse_time(date=None):
@@ -52,4 +53,4 @@ def update_job(
     )
 
 
-producer = get_producer_interface()
+producer = get_producer()
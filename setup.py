@@ -11,6 +11,9 @@ setup(
         "Scrapy>=1.0",
         "requests",
         "redis",
+        "orjson",
+        "lz4",
+        "kafka-python>=2.0",
         "estela-queue-adapter @ git+https://github.com/bitmakerla/estela-queue-adapter.git",
     ],
     entry_points={
@@ -5,6 +5,7 @@ from estela_scrapy.env import (
     decode_job,
     get_api_args,
     get_args_and_env,
+    job_context,
     setup_scrapy_conf,
 )
 
@@ -54,6 +55,28 @@ def test_get_args_and_env():
     }
 
 
+@mock.patch.dict(
+    os.environ,
+    {
+        "ESTELA_SPIDER_JOB": "1.2.3",
+        "ESTELA_API_HOST": "http://estela-api.com",
+        "ESTELA_AUTH_TOKEN": "token",
+        "ESTELA_COLLECTION": "sj-1-2",
+        "ESTELA_UNIQUE_COLLECTION": "True",
+    },
+)
+def test_job_context():
+    job_context.cache_clear()
+    ctx = job_context()
+    assert (ctx.jid, ctx.sid, ctx.pid) == ("1", "2", "3")
+    assert ctx.job_url == "http://estela-api.com/api/projects/3/spiders/2/jobs/1"
+    assert ctx.collection == "sj-1-2"
+    assert ctx.unique == "True"
+    # Parsed once per process, later calls reuse the cached context
+    assert job_context() is ctx
+    job_context.cache_clear()
+
+
 @mock.patch("builtins.open")
 def test_setup_scrapy_conf(mock_open):
     setup_scrapy_conf()
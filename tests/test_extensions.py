@@ -0,0 +1,120 @@
+import os
+from unittest import mock
+
+from scrapy import Field, Item
+
+from estela_scrapy.env import job_context
+from estela_scrapy.extensions import ItemStorageExtension, RedisStatsCollector
+
+JOB_ENV = {
+    "ESTELA_SPIDER_JOB": "1.2.3",
+    "ESTELA_API_HOST": "http://estela-api.com",
+    "ESTELA_AUTH_TOKEN": "",
+    "ESTELA_COLLECTION": "sj-1-2",
+    "ESTELA_UNIQUE_COLLECTION": "True",
+}
+
+REDIS_ENV = dict(
+    JOB_ENV,
+    REDIS_URL="redis://localhost:6379",
+    REDIS_STATS_KEY="stats:1.2.3",
+    REDIS_STATS_INTERVAL="5.0",
+)
+
+
+def make_stats_collector(stats):
+    job_context.cache_clear()
+    with mock.patch.dict(os.environ, REDIS_ENV):
+        with mock.patch("estela_scrapy.extensions.redis"):
+            collector = RedisStatsCollector(stats)
+    collector.redis_conn = mock.Mock()
+    collector.start_time = 0.0
+    return collector
+
+
+class SampleItem(Item):
+    name = Field()
+    price = Field(serializer=str)
+
+
+@mock.patch.dict(os.environ, JOB_ENV)
+def test_export_item_copies_dict_items():
+    job_context.cache_clear()
+    ext = ItemStorageExtension(mock.Mock())
+    original = {"name": "a"}
+    exported = ext._export_item(original)
+    assert exported == original
+    assert exported is not original
+
+
+@mock.patch.dict(os.environ, JOB_ENV)
+def test_export_item_applies_field_serializers():
+    job_context.cache_clear()
+    ext = ItemStorageExtension(mock.Mock())
+    item = SampleItem(name="a", price=10)
+    assert ext._export_item(item) == {"name": "a", "price": "10"}
+    assert SampleItem in ext._serializer_cache
+
+
+@mock.patch.dict(os.environ, JOB_ENV)
+def test_export_item_recurses_into_nested_items():
+    job_context.cache_clear()
+    ext = ItemStorageExtension(mock.Mock())
+
+    class OuterItem(Item):
+        inner = Field()
+        tags = Field()
+
+    item = OuterItem(inner=SampleItem(price=10), tags=[SampleItem(price=20)])
+    assert ext._export_item(item) == {
+        "inner": {"price": "10"},
+        "tags": [{"price": "20"}],
+    }
+
+
+@mock.patch.dict(os.environ, JOB_ENV)
+def test_export_item_recurses_into_dict_items():
+    job_context.cache_clear()
+    ext = ItemStorageExtension(mock.Mock())
+    item = {"inner": SampleItem(price=10), "plain": {"x": 1}}
+    assert ext._export_item(item) == {"inner": {"price": "10"}, "plain": {"x": 1}}
+
+
+def test_store_stats_skips_pipeline_when_unchanged():
+    stats = mock.Mock()
+    stats.get_stats.return_value = {"item_scraped_count": 10}
+    collector = make_stats_collector(stats)
+    with mock.patch("estela_scrapy.extensions.time.monotonic", return_value=100.0):
+        collector.store_stats(spider=None)
+        collector.redis_conn.reset_mock()
+        collector.store_stats(spider=None)
+    assert not collector.redis_conn.pipeline.called
+
+
+def test_store_stats_sends_delta_through_pipeline():
+    stats = mock.Mock()
+    stats.get_stats.return_value = {"item_scraped_count": 10}
+    collector = make_stats_collector(stats)
+    with mock.patch("estela_scrapy.extensions.time.monotonic", return_value=100.0):
+        collector.store_stats(spider=None)
+        collector.redis_conn.reset_mock()
+        stats.get_stats.return_value = {"item_scraped_count": 12}
+        collector.store_stats(spider=None)
+    assert collector.redis_conn.pipeline.call_args == mock.call(transaction=False)
+    pipe = collector.redis_conn.pipeline.return_value
+    pipe.hset.assert_called_once_with(
+        "stats:1.2.3", mapping={"item_scraped_count": 12}
+    )
+    pipe.expire.assert_called_once_with("stats:1.2.3", 60)
+    assert pipe.execute.called
+
+
+def test_store_stats_flattens_container_values():
+    stats = mock.Mock()
+    stats.get_stats.return_value = {"downloader/slots": {"active": [1, 2]}}
+    collector = make_stats_collector(stats)
+    with mock.patch("estela_scrapy.extensions.time.monotonic", return_value=100.0):
+        collector.store_stats(spider=None)
+    pipe = collector.redis_conn.pipeline.return_value
+    mapping = pipe.hset.call_args[1]["mapping"]
+    assert mapping["downloader/slots"] == str({"active": [1, 2]})
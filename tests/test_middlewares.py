@@ -0,0 +1,101 @@
+import os
+from unittest import mock
+
+from scrapy.http import Headers, Request, Response
+
+from estela_scrapy.env import job_context
+from estela_scrapy.middlewares import (
+    StorageDownloaderMiddleware,
+    get_header_size,
+    get_status_size,
+)
+
+JOB_ENV = {"ESTELA_SPIDER_JOB": "1.2.3"}
+
+
+def test_get_header_size():
+    headers = Headers({"Content-Type": "text/html", "Set-Cookie": ["a=1", "b=2"]})
+    # 3 header lines: key + ": " + value each, plus "\r\n" between lines
+    expected = (12 + 2 + 9) + 2 * (10 + 2 + 3) + 2 * 2
+    assert get_header_size(headers) == expected
+
+
+def test_get_header_size_empty():
+    assert get_header_size(Headers()) == 0
+
+
+def test_get_status_size():
+    assert get_status_size(200) == len(b"OK") + 15
+    assert get_status_size(999) == 15
+
+
+@mock.patch.dict(os.environ, JOB_ENV)
+@mock.patch("estela_scrapy.middlewares.producer")
+def test_process_response_buffers_until_flush(mock_producer):
+    job_context.cache_clear()
+    fingerprinter = mock.Mock()
+    fingerprinter.fingerprint.return_value = b"\x00\xff"
+    mw = StorageDownloaderMiddleware(fingerprinter)
+    request = Request("http://example.com")
+    response = Response("http://example.com", request=request)
+
+    assert mw.process_response(request, response, spider=None) is response
+    assert len(mw.buffer) == 1
+    assert not mock_producer.send.called
+
+    mw.flush()
+    assert len(mw.buffer) == 0
+    assert mock_producer.send.call_count == 1
+    topic, data = mock_producer.send.call_args[0]
+    assert topic == "job_requests"
+    assert data["payload"]["url"] == "http://example.com"
+
+
+@mock.patch.dict(os.environ, JOB_ENV)
+@mock.patch("estela_scrapy.middlewares.producer")
+def test_flush_requeues_unsent_payloads_on_failure(mock_producer):
+    job_context.cache_clear()
+    mw = StorageDownloaderMiddleware()
+    mw.buffer.extend([{"n": 1}, {"n": 2}, {"n": 3}])
+    mock_producer.send.side_effect = [None, Exception("kafka down")]
+
+    mw.flush()
+    assert list(mw.buffer) == [{"n": 2}, {"n": 3}]
+
+    mock_producer.send.side_effect = None
+    mw.flush()
+    assert len(mw.buffer) == 0
+    assert mock_producer.send.call_count == 4
+
+
+@mock.patch.dict(os.environ, JOB_ENV)
+def test_get_fingerprint_does_not_leak_through_meta():
+    job_context.cache_clear()
+    fingerprinter = mock.Mock()
+    fingerprinter.fingerprint.return_value = b"\x00\xff"
+    mw = StorageDownloaderMiddleware(fingerprinter)
+    request = Request("http://example.com")
+
+    assert mw.get_fingerprint(request) == "00ff"
+    # request.replace() copies meta (e.g. on redirects), so the fingerprint
+    # must not be stashed there
+    assert "_fingerprint" not in request.meta
+    redirected = request.replace(url="http://example.com/redirected")
+    fingerprinter.fingerprint.return_value = b"\x11\x22"
+    assert mw.get_fingerprint(redirected) == "1122"
+
+
+@mock.patch.dict(os.environ, JOB_ENV)
+@mock.patch("estela_scrapy.middlewares.request_fingerprint")
+def test_get_fingerprint_legacy_fallback_cached_per_request(mock_request_fingerprint):
+    job_context.cache_clear()
+    mock_request_fingerprint.return_value = "00ff"
+    mw = StorageDownloaderMiddleware()
+    request = Request("http://example.com")
+
+    assert mw.get_fingerprint(request) == "00ff"
+    assert mw.get_fingerprint(request) == "00ff"
+    assert mock_request_fingerprint.call_count == 1
+    other = request.replace(url="http://example.com/other")
+    mw.get_fingerprint(other)
+    assert mock_request_fingerprint.call_count == 2
@@ -0,0 +1,44 @@
+import os
+from unittest import mock
+
+from kafka import KafkaProducer
+
+from estela_scrapy.producer import (
+    KAFKA_PRODUCER_CONFIG,
+    BatchedKafkaProducer,
+    connect_kafka_producer,
+    get_producer,
+)
+
+
+@mock.patch.dict(
+    os.environ, {"QUEUE_PLATFORM_LISTENERS": "broker", "QUEUE_PLATFORM_PORT": "9092"}
+)
+def test_connect_kafka_producer():
+    producer = connect_kafka_producer()
+    assert isinstance(producer, BatchedKafkaProducer)
+    assert producer.listeners == "broker"
+    assert producer.port == "9092"
+
+
+def test_get_producer_returns_batched_kafka_producer():
+    assert isinstance(get_producer(), BatchedKafkaProducer)
+
+
+def test_get_connection_uses_batching_config():
+    # Construct a real (unconnected) KafkaProducer so a config key the
+    # installed kafka-python does not recognize fails here, not at job start.
+    producer = BatchedKafkaProducer(listeners="localhost", port="9092")
+    try:
+        assert producer.get_connection()
+        assert isinstance(producer.producer, KafkaProducer)
+        config = producer.producer.config
+        assert config["batch_size"] == KAFKA_PRODUCER_CONFIG["batch_size"]
+        assert config["linger_ms"] == KAFKA_PRODUCER_CONFIG["linger_ms"]
+        for key, value in KAFKA_PRODUCER_CONFIG.items():
+            # api_version gets normalized by the client (e.g. to a 3-tuple)
+            if key != "api_version" and key in KafkaProducer.DEFAULT_CONFIG:
+                assert config[key] == value
+    finally:
+        if producer.producer is not None:
+            producer.close()